@@ -1,77 +1,608 @@
-import os
 import json
-import requests
+import hashlib
+import operator
+import queue
+import re
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import orjson  # opcional: decodificador JSON en C, bastante más rápido
+except ImportError:
+    orjson = None
+try:
+    import msgpack  # opcional: formato binario para /items, más compacto y rápido de decodificar
+except ImportError:
+    msgpack = None
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-from datetime import datetime
 
 # -------------------------
 # Configuración
 # -------------------------
 SERVER_URL = "http://localhost:5000"  # Cambia a la IP del servidor si no está en localhost
 API_KEY = "tu_clave_api_aqui"  # Ingresar la clave API al iniciar
+POLL_INTERVAL_MS = 10000  # Refresco por sondeo (solo si falla la conexión de eventos)
+MAX_POLL_INTERVAL_MS = 300000  # Tope del intervalo cuando el inventario no cambia
+REQUEST_TIMEOUT = (2, 5)  # (conexión, lectura) en segundos
+WRITE_TIMEOUT = (2, 30)  # escrituras: más margen de lectura, un reintento podría duplicarlas
+ITEM_FIELDS = ("id", "nombre", "descripcion", "cantidad", "precio_usd", "precio_bs")
+
+MSGPACK_MIMETYPE = "application/x-msgpack"
+
+def decode_json(content):
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def decode_body(response):
+    if response.headers.get("Content-Type", "").startswith(MSGPACK_MIMETYPE):
+        return msgpack.unpackb(response.content, raw=False)
+    return decode_json(response.content)
+
+def inventory_rows(body):
+    """Filas de /items ({"columns": [...], "rows": [[...]]}) como tuplas en el orden de ITEM_FIELDS."""
+    columns = body["columns"]
+    if tuple(columns) == ITEM_FIELDS:
+        return [tuple(row) for row in body["rows"]]
+    getter = operator.itemgetter(*(columns.index(field) for field in ITEM_FIELDS))
+    return [getter(row) for row in body["rows"]]
+
+# -------------------------
+# Sesión HTTP (keep-alive + pool de conexiones)
+# -------------------------
+# requests se importa al crear la sesión (primera petición, ya en un hilo de fondo) para
+# no retrasar la aparición de la ventana. Sus excepciones derivan de OSError, que es lo
+# que se captura en el resto del módulo.
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            session = requests.Session()
+            session.headers["Accept-Encoding"] = "gzip"
+            session.headers["X-API-KEY"] = API_KEY or ""
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+# Las peticiones se hacen en estos hilos para no congelar la UI
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+def request_not_sent(e):
+    """True si la excepción garantiza que la petición no llegó al servidor (no se pudo conectar)."""
+    # requests y urllib3 ya están cargados aquí
+    from requests.exceptions import ConnectTimeout, ConnectionError as RequestsConnectionError
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(e, ConnectTimeout):
+        return True
+    if not isinstance(e, RequestsConnectionError):
+        return False
+    # requests envuelve MaxRetryError, cuyo .reason es el error original de urllib3
+    reason = e.args[0] if e.args else None
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, NewConnectionError)
+
+def run_in_background(request_fn, on_done, on_error=None, on_timeout=None):
+    """Ejecuta request_fn en EXECUTOR y llama on_done(response) en el hilo de Tk al terminar.
+
+    Si la conexión falla se muestra el error y se llama on_error() (si se indicó). Si se
+    indicó on_timeout, solo los fallos en los que la petición seguro no salió llegan a
+    on_error(); cualquier otro (timeout de lectura, conexión cortada...) llama on_timeout()
+    en su lugar: el servidor pudo haberla aplicado.
+    """
+    future = EXECUTOR.submit(request_fn)
+
+    def check():
+        if not future.done():
+            window.after(50, check)
+            return
+        try:
+            response = future.result()
+        except OSError as e:
+            if on_timeout and not request_not_sent(e):
+                on_timeout()
+                return
+            messagebox.showerror("Error", f"No se pudo conectar al servidor: {e}")
+            if on_error:
+                on_error()
+            return
+        on_done(response)
+
+    window.after(50, check)
 
 # -------------------------
 # Funciones de sincronización
 # -------------------------
-def sync_inventory():
+# Última respuesta de /items como foto (event_seq, filas en el orden de ITEM_FIELDS).
+# event_seq es el último evento SSE que la foto ya refleja (None si el servidor no lo envía).
+# Si el servidor no envía ETag se usa un hash del cuerpo.
+_inventory_cache = {"etag": None, "snapshot": (None, [])}
+_inventory_lock = threading.Lock()
+_painted_inventory = None
+# event_seq de la foto más reciente guardada en caché (0: aceptar cualquiera). Se reinicia con
+# ready/resync/desconexión, porque un servidor reiniciado vuelve a numerar los eventos.
+_snapshot_seq = 0
+
+def event_seq(response):
+    seq = response.headers.get("X-Event-Seq")
+    return int(seq) if seq is not None else None
+
+def cache_snapshot(etag, snapshot):
+    """Guarda la foto en la caché salvo que la guardada sea más reciente; devuelve la que queda vigente."""
+    global _snapshot_seq
+    seq = snapshot[0]
+    with _inventory_lock:
+        if seq is not None and seq < _snapshot_seq:
+            # una descarga lenta terminó después de otra foto más nueva (p. ej. la de un lote)
+            return _inventory_cache["snapshot"]
+        if seq is not None:
+            _snapshot_seq = seq
+        _inventory_cache["etag"] = etag
+        _inventory_cache["snapshot"] = snapshot
+    return snapshot
+
+class SyncError(Exception):
+    pass
+
+def fetch_inventory():
+    """Descarga /items (con caché ETag). No toca la UI: se puede llamar desde un hilo de fondo."""
+    headers = {}
+    if msgpack:
+        headers["Accept"] = f"{MSGPACK_MIMETYPE}, application/json;q=0.5"
+    if _inventory_cache["etag"]:
+        headers["If-None-Match"] = _inventory_cache["etag"]
     try:
-        response = requests.get(f"{SERVER_URL}/items", headers={"X-API-KEY": API_KEY})
-        if response.status_code == 200:
-            inventory = response.json()["items"]
-            return inventory
+        # solo las columnas que muestra el treeview, como columnas + filas (sin un objeto por artículo)
+        params = {"fields": ",".join(ITEM_FIELDS), "format": "rows"}
+        with get_session().get(f"{SERVER_URL}/items", params=params, headers=headers, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code == 304:
+                return _inventory_cache["snapshot"]
+            if response.status_code != 200:
+                raise SyncError("No se pudo sincronizar el inventario.")
+            etag = response.headers.get("ETag")
+            if not etag:
+                etag = hashlib.blake2b(response.content, digest_size=16).hexdigest()
+                if etag == _inventory_cache["etag"]:
+                    return _inventory_cache["snapshot"]
+            inventory = inventory_rows(decode_body(response))
+    except OSError as e:
+        raise SyncError(f"No se pudo conectar al servidor: {e}")
+    return cache_snapshot(etag, (event_seq(response), inventory))
+
+class SWRCache:
+    """Stale-while-revalidate: get() devuelve al instante el último valor y revalida en segundo plano.
+
+    Solo hay una descarga en curso a la vez; on_update/on_error se llaman desde el hilo de fondo.
+    """
+
+    def __init__(self, fetch, on_update, on_error, min_stale=2.0, max_ttl=30.0):
+        self.fetch = fetch
+        self.on_update = on_update
+        self.on_error = on_error
+        self.min_stale = min_stale
+        self.max_ttl = max_ttl
+        self.value = None
+        self.cached_at = 0.0
+        self.inflight = threading.Event()
+
+    def get(self, revalidate=False):
+        age = time.monotonic() - self.cached_at
+        if revalidate or age > self.min_stale:
+            self._revalidate()
+        return self.value if age < self.max_ttl else None
+
+    def set(self, value):
+        self.value = value
+        self.cached_at = time.monotonic()
+
+    def _revalidate(self):
+        if self.inflight.is_set():
+            return
+        self.inflight.set()
+        EXECUTOR.submit(self._run)
+
+    def _run(self):
+        try:
+            value = self.fetch()
+        except Exception as e:
+            self.on_error(e)
         else:
-            messagebox.showerror("Error", "No se pudo sincronizar el inventario.")
-            return []
-    except requests.exceptions.RequestException as e:
-        messagebox.showerror("Error", f"No se pudo conectar al servidor: {e}")
-        return []
-
-def update_inventory_display():
-    inventory = sync_inventory()
-    for row in treeview.get_children():
-        treeview.delete(row)
-    for item in inventory:
-        treeview.insert("", "end", values=(item["id"], item["nombre"], item["descripcion"], item["cantidad"], item["precio_usd"], item["precio_bs"]))
+            self.set(value)
+            self.on_update(value)
+        finally:
+            self.inflight.clear()
+
+swr_inventory = SWRCache(
+    fetch_inventory,
+    on_update=lambda snapshot: _events_queue.put(("inventory", snapshot)),
+    on_error=lambda e: _events_queue.put(("sync_error", str(e))),
+)
+
+# Valores mostrados en cada fila del treeview, por id (iid de la fila)
+_row_state = {}
+
+# Tupla de valores de una fila, en el orden de las columnas del treeview
+_row_getter = operator.itemgetter(*ITEM_FIELDS)
+
+def put_row(values):
+    item_id = values[0]
+    old = _row_state.get(item_id)
+    if old is None:
+        treeview.insert("", "end", iid=item_id, values=values)
+    elif old != values:
+        for col, old_value, new_value in zip(columns, old, values):
+            if old_value != new_value:
+                treeview.set(item_id, col, new_value)
+    _row_state[item_id] = values
+
+def remove_row(item_id):
+    if _row_state.pop(item_id, None) is not None:
+        treeview.delete(item_id)
+
+def paint_inventory(snapshot):
+    # Solo inserta, borra o modifica las filas que cambiaron
+    global _painted_inventory
+    if snapshot is None or snapshot is _painted_inventory:
+        return  # sin cambios desde el último pintado
+    seq, inventory = snapshot
+    if seq is not None and seq < _applied_seq:
+        # Foto anterior a eventos ya aplicados: pintarla desharía esos cambios.
+        # Se pide otra un poco después (el servidor la invalida al terminar la escritura).
+        window.after(1000, swr_inventory.get, True)
+        return
+    if seq is not None and seq < _snapshot_seq:
+        return  # ya hay en caché (y se pinta) una foto más reciente
+    _painted_inventory = snapshot
+    new_rows = {values[0]: values for values in inventory}
+    for item_id in _row_state.keys() - new_rows.keys():
+        remove_row(item_id)
+    for values in new_rows.values():
+        put_row(values)
+
+def update_inventory_display(revalidate=True):
+    # Pinta lo que hay en caché y deja que la revalidación en segundo plano actualice la vista
+    paint_inventory(swr_inventory.get(revalidate))
 
 def refresh_inventory():
-    inventory = sync_inventory()
-    for row in treeview.get_children():
-        treeview.delete(row)
-    for item in inventory:
-        treeview.insert("", "end", values=(item["id"], item["nombre"], item["descripcion"], item["cantidad"], item["precio_usd"], item["precio_bs"]))
-    window.after(10000, refresh_inventory)  # Refrescar cada 10 segundos
+    global _polling, _poll_after_id
+    if _events_connected.is_set():
+        # La conexión de eventos volvió: se detiene el sondeo
+        _polling = False
+        _poll_after_id = None
+        return
+    if not _paused and window.winfo_viewable():
+        update_inventory_display()
+    _poll_after_id = window.after(_poll_interval_ms, refresh_inventory)
+
+def note_inventory_result(changed):
+    # Sin cambios se duplica el intervalo de sondeo (hasta el tope); con cambios vuelve al mínimo
+    global _poll_interval_ms
+    if changed:
+        _poll_interval_ms = POLL_INTERVAL_MS
+    else:
+        _poll_interval_ms = min(_poll_interval_ms * 2, MAX_POLL_INTERVAL_MS)
+
+def reset_poll_interval():
+    # Tras un cambio local se vuelve a sondear pronto para confirmarlo
+    global _poll_interval_ms, _poll_after_id
+    _poll_interval_ms = POLL_INTERVAL_MS
+    if _polling and _poll_after_id is not None:
+        window.after_cancel(_poll_after_id)
+        _poll_after_id = window.after(_poll_interval_ms, refresh_inventory)
+
+def update_paused():
+    # Sin foco (o minimizada) la ventana no sondea; al recuperarlo se revalida enseguida
+    global _paused
+    was_paused = _paused
+    _paused = window.focus_get() is None
+    if was_paused and not _paused and _polling:
+        update_inventory_display(revalidate=False)
+
+def start_polling():
+    global _polling, _poll_after_id
+    if _polling:
+        return
+    _polling = True
+    _poll_after_id = window.after(_poll_interval_ms, refresh_inventory)
 
 # -------------------------
-# Funciones CRUD
+# Eventos en tiempo real (Server-Sent Events)
 # -------------------------
-def add_item():
-    item_id = simpledialog.askstring("Agregar artículo", "ID del artículo:")
-    if not item_id:
-        return
-    nombre = simpledialog.askstring("Agregar artículo", "Nombre del artículo:")
-    if not nombre:
+_events_queue = queue.Queue()
+_events_connected = threading.Event()
+_last_event_id = None
+_applied_seq = 0  # id del último evento de artículo aplicado (0: aceptar cualquier foto)
+_polling = False
+_paused = False
+_poll_interval_ms = POLL_INTERVAL_MS
+_poll_after_id = None
+
+def listen_events():
+    """Hilo de fondo: mantiene abierta la suscripción a /events y encola los eventos recibidos."""
+    global _last_event_id
+    retry = 1
+    while True:
+        headers = {"Accept": "text/event-stream"}
+        if _last_event_id is not None:
+            headers["Last-Event-ID"] = _last_event_id
+        try:
+            with get_session().get(f"{SERVER_URL}/events", headers=headers, stream=True, timeout=(5, 45)) as response:
+                if response.status_code != 200:
+                    raise ConnectionError(f"HTTP {response.status_code}")
+                _events_connected.set()
+                retry = 1
+                event_type, data = "message", []
+                for line in response.iter_lines(decode_unicode=True):
+                    if line is None:
+                        continue
+                    if not line:
+                        # Línea vacía: fin del evento
+                        if data:
+                            seq = int(_last_event_id) if _last_event_id is not None else None
+                            _events_queue.put((event_type, decode_json("\n".join(data)), seq))
+                        event_type, data = "message", []
+                    elif line.startswith(":"):
+                        continue  # comentario / keepalive
+                    else:
+                        field, _, value = line.partition(":")
+                        value = value[1:] if value.startswith(" ") else value
+                        if field == "event":
+                            event_type = value
+                        elif field == "data":
+                            data.append(value)
+                        elif field == "id":
+                            _last_event_id = value
+        except (OSError, ValueError):
+            pass
+        _events_connected.clear()
+        _events_queue.put(("disconnected", None))
+        time.sleep(retry)
+        retry = min(retry * 2, 30)
+
+def apply_delta(event_type, data, seq=None):
+    global _applied_seq, _snapshot_seq
+    if event_type == "disconnected":
+        # sin eventos no hay nada con qué comparar las fotos del sondeo
+        _applied_seq = 0
+        _snapshot_seq = 0
+        start_polling()
         return
-    descripcion = simpledialog.askstring("Agregar artículo", "Descripción del artículo:")
-    cantidad = simpledialog.askinteger("Agregar artículo", "Cantidad disponible:")
-    precio_usd = simpledialog.askfloat("Agregar artículo", "Precio en USD:")
-    precio_bs = simpledialog.askfloat("Agregar artículo", "Precio en Bs:")
-    
-    item_data = {
-        "id": item_id,
-        "nombre": nombre,
-        "descripcion": descripcion,
-        "cantidad": cantidad,
-        "precio_usd": precio_usd,
-        "precio_bs": precio_bs
-    }
-
-    response = requests.post(f"{SERVER_URL}/items", json=item_data, headers={"X-API-KEY": API_KEY})
-    if response.status_code == 200:
-        messagebox.showinfo("Éxito", "Artículo agregado correctamente.")
+    if event_type in ("ready", "resync"):
+        _applied_seq = 0
+        _snapshot_seq = 0
         update_inventory_display()
-    else:
-        messagebox.showerror("Error", "No se pudo agregar el artículo.")
+        return
+    if event_type == "inventory":
+        note_inventory_result(data is not _painted_inventory)
+        paint_inventory(data)
+        return
+    if event_type == "sync_error":
+        messagebox.showerror("Error", data)
+        return
+    if event_type == "last_update":
+        # aviso genérico de cambio; los eventos de detalle ya traen los datos
+        return
+    item_id = data.get("id")
+    if seq is not None:
+        _applied_seq = max(_applied_seq, seq)
+    if event_type in ("item_created", "item_updated"):
+        put_row(_row_getter(data))
+    elif event_type == "item_deleted":
+        remove_row(item_id)
+    elif event_type == "stock_changed":
+        old = _row_state.get(item_id)
+        if old is not None:
+            put_row(old[:3] + (data["cantidad"],) + old[4:])
+
+def pump_events():
+    """Aplica en el hilo de Tk lo encolado por los hilos de fondo (eventos y revalidaciones)."""
+    global _painted_inventory
+    try:
+        while True:
+            try:
+                entry = _events_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                apply_delta(*entry)
+            except Exception:
+                # un evento defectuoso no debe detener el bombeo: se registra y se pide
+                # el inventario completo para que el siguiente pintado corrija la vista
+                traceback.print_exc()
+                _painted_inventory = None
+                swr_inventory.get(True)
+    finally:
+        window.after(100, pump_events)
+
+# -------------------------
+# Operaciones agrupadas (/items/batch)
+# -------------------------
+# Mensajes (éxito, error) por tipo de operación
+OP_MESSAGES = {
+    "add": ("Artículo agregado correctamente.", "No se pudo agregar el artículo."),
+    "update": ("Artículo editado correctamente.", "No se pudo editar el artículo."),
+    "delete": ("Artículo eliminado correctamente.", "No se pudo eliminar el artículo."),
+    "sell": ("Venta registrada correctamente.", "No se pudo realizar la venta."),
+    "return": ("Devolución registrada correctamente.", "No se pudo realizar la devolución."),
+}
+BATCH_DEBOUNCE_MS = 150
+
+_pending_ops = []
+_pending_undo = []  # (item_id, valores previos, posición) por operación, para deshacer
+_flush_after_id = None
+
+def apply_optimistic(op, payload):
+    """Refleja la operación en el treeview sin esperar al servidor. Devuelve cómo deshacerla."""
+    item_id = payload["id"]
+    previous = _row_state.get(item_id)
+    index = treeview.index(item_id) if previous is not None else "end"
+    if op in ("add", "update"):
+        put_row(_row_getter(payload))
+    elif op == "delete":
+        remove_row(item_id)
+    elif previous is not None:
+        delta = -payload["quantity"] if op == "sell" else payload["quantity"]
+        put_row(previous[:3] + (previous[3] + delta,) + previous[4:])
+    return item_id, previous, index
+
+def rollback_optimistic(undo):
+    for item_id, previous, index in reversed(undo):
+        if previous is None:
+            remove_row(item_id)
+        elif item_id in _row_state:
+            put_row(previous)
+        else:
+            treeview.insert("", index, iid=item_id, values=previous)
+            _row_state[item_id] = previous
+
+def queue_op(op, payload):
+    """Aplica la operación en la vista, la encola y reprograma el envío del lote."""
+    global _flush_after_id
+    _pending_undo.append(apply_optimistic(op, payload))
+    _pending_ops.append({"op": op, "payload": payload})
+    reset_poll_interval()
+    if _flush_after_id is not None:
+        window.after_cancel(_flush_after_id)
+    _flush_after_id = window.after(BATCH_DEBOUNCE_MS, flush_pending)
+
+def flush_pending():
+    """Envía las operaciones pendientes en una sola petición; la respuesta trae el inventario nuevo."""
+    global _flush_after_id
+    _flush_after_id = None
+    ops = _pending_ops[:]
+    undo = _pending_undo[:]
+    _pending_ops.clear()
+    _pending_undo.clear()
+    if not ops:
+        return
+
+    def _do_batch():
+        return get_session().post(f"{SERVER_URL}/items/batch", params={"format": "rows"}, json={"ops": ops}, timeout=WRITE_TIMEOUT)
+
+    def _on_batch_done(response):
+        if response.status_code != 200:
+            rollback_optimistic(undo)
+            for op in ops:
+                messagebox.showerror("Error", OP_MESSAGES[op["op"]][1])
+            return
+        body = decode_json(response.content)
+        # El inventario devuelto es el estado autoritativo: no hace falta otro GET y
+        # corrige las operaciones optimistas que el servidor rechazó. Se pinta antes de
+        # los mensajes: cada messagebox anida el bucle de Tk y los eventos SSE que lleguen
+        # mientras tanto no deben quedar tapados por esta foto.
+        snapshot = cache_snapshot(None, (event_seq(response), inventory_rows(body)))
+        swr_inventory.set(snapshot)
+        paint_inventory(snapshot)
+        for op, result in zip(ops, body["results"]):
+            ok_msg, error_msg = OP_MESSAGES[op["op"]]
+            if result.get("ok"):
+                messagebox.showinfo("Éxito", ok_msg)
+            else:
+                messagebox.showerror("Error", f"{error_msg}\n{result.get('error', '')}".strip())
+
+    def _on_batch_timeout():
+        # No se sabe si el lote se aplicó: deshacer y dejar que el usuario repita podría
+        # duplicar una venta. Se vuelve a pintar desde el servidor (olvidando la foto pintada,
+        # para que también desaparezcan los cambios optimistas si el lote no se aplicó).
+        global _painted_inventory
+        _painted_inventory = None
+        messagebox.showwarning(
+            "Sin respuesta",
+            "No llegó la respuesta del servidor y la operación pudo haberse aplicado.\n"
+            "Se recargará el inventario; compruébalo antes de repetirla.")
+        update_inventory_display(True)
+
+    run_in_background(_do_batch, _on_batch_done, lambda: rollback_optimistic(undo), _on_batch_timeout)
+
+# -------------------------
+# Formulario de artículo
+# -------------------------
+def validate_int(text):
+    return re.fullmatch(r"\d*", text) is not None
+
+def validate_float(text):
+    return re.fullmatch(r"\d*\.?\d*", text) is not None
+
+class ItemDialog(tk.Toplevel):
+    """Formulario modal con todos los campos de un artículo. Al cerrarse, result es un dict o None."""
+
+    FIELDS = (
+        ("id", "ID", str),
+        ("nombre", "Nombre", str),
+        ("descripcion", "Descripción", str),
+        ("cantidad", "Cantidad", int),
+        ("precio_usd", "Precio USD", float),
+        ("precio_bs", "Precio Bs", float),
+    )
+
+    def __init__(self, parent, title, initial=None, lock_id=False):
+        super().__init__(parent)
+        self.title(title)
+        self.transient(parent)
+        self.resizable(False, False)
+        self.result = None
+        initial = initial or {}
+
+        # La validación por tecla evita tener que rechazar números inválidos al aceptar
+        validators = {
+            int: (self.register(validate_int), "%P"),
+            float: (self.register(validate_float), "%P"),
+        }
+        form = ttk.Frame(self, padding=12)
+        form.pack(fill="both", expand=True)
+        self.entries = {}
+        for row, (key, label, kind) in enumerate(self.FIELDS):
+            ttk.Label(form, text=f"{label}:").grid(row=row, column=0, sticky="w", padx=(0, 8), pady=2)
+            entry = ttk.Entry(form, width=36)
+            if initial.get(key) is not None:
+                entry.insert(0, str(initial[key]))
+            if kind is not str:
+                # después de insert: el valor inicial (negativo, 1e-05...) no pasa por la validación
+                entry.configure(validate="key", validatecommand=validators[kind])
+            if key == "id" and lock_id:
+                entry.state(["readonly"])
+            entry.grid(row=row, column=1, pady=2)
+            self.entries[key] = entry
+
+        buttons = ttk.Frame(self, padding=(12, 0, 12, 12))
+        buttons.pack(fill="x")
+        ttk.Button(buttons, text="Cancelar", command=self.destroy).pack(side="right")
+        ttk.Button(buttons, text="Aceptar", command=self._on_ok).pack(side="right", padx=6)
+
+        self.bind("<Return>", lambda e: self._on_ok())
+        self.bind("<Escape>", lambda e: self.destroy())
+        self.protocol("WM_DELETE_WINDOW", self.destroy)
+        self.entries["nombre" if lock_id else "id"].focus_set()
+        # en X11 grab_set falla si la ventana aún no está visible (igual que simpledialog)
+        self.wait_visibility()
+        self.grab_set()
+        self.wait_window()
+
+    def _on_ok(self):
+        values = {key: self.entries[key].get().strip() for key, _, _ in self.FIELDS}
+        if not values["id"] or not values["nombre"]:
+            messagebox.showwarning("Advertencia", "El ID y el nombre son obligatorios.", parent=self)
+            return
+        for key, _, kind in self.FIELDS:
+            if kind is not str:
+                values[key] = kind(values[key]) if values[key].strip(".") else kind()
+        self.result = values
+        self.destroy()
+
+# -------------------------
+# Funciones CRUD
+# -------------------------
+def add_item():
+    dialog = ItemDialog(window, "Agregar artículo")
+    if dialog.result:
+        queue_op("add", dialog.result)
 
 def edit_item():
     selected_item = treeview.selection()
@@ -80,29 +611,19 @@ def edit_item():
         return
 
     item_id = treeview.item(selected_item, "values")[0]
-    item = get_item_by_id(item_id)
-
-    new_name = simpledialog.askstring("Editar artículo", f"Nuevo nombre ({item['nombre']}):", initialvalue=item['nombre'])
-    new_desc = simpledialog.askstring("Editar artículo", f"Nuevo descripción ({item['descripcion']}):", initialvalue=item['descripcion'])
-    new_qty = simpledialog.askinteger("Editar artículo", f"Nueva cantidad ({item['cantidad']}):", initialvalue=item['cantidad'])
-    new_price_usd = simpledialog.askfloat("Editar artículo", f"Nuevo precio USD ({item['precio_usd']}):", initialvalue=item['precio_usd'])
-    new_price_bs = simpledialog.askfloat("Editar artículo", f"Nuevo precio Bs ({item['precio_bs']}):", initialvalue=item['precio_bs'])
-
-    updated_item = {
-        "id": item_id,
-        "nombre": new_name,
-        "descripcion": new_desc,
-        "cantidad": new_qty,
-        "precio_usd": new_price_usd,
-        "precio_bs": new_price_bs
-    }
-
-    response = requests.put(f"{SERVER_URL}/items/{item_id}", json=updated_item, headers={"X-API-KEY": API_KEY})
-    if response.status_code == 200:
-        messagebox.showinfo("Éxito", "Artículo editado correctamente.")
-        update_inventory_display()
-    else:
-        messagebox.showerror("Error", "No se pudo editar el artículo.")
+
+    def _do_get():
+        return get_session().get(f"{SERVER_URL}/items/{item_id}", timeout=REQUEST_TIMEOUT)
+
+    def _on_get_done(response):
+        if response.status_code != 200:
+            messagebox.showerror("Error", "No se pudo obtener el artículo.")
+            return
+        dialog = ItemDialog(window, "Editar artículo", initial=decode_json(response.content), lock_id=True)
+        if dialog.result:
+            queue_op("update", dialog.result)
+
+    run_in_background(_do_get, _on_get_done)
 
 def delete_item():
     selected_item = treeview.selection()
@@ -114,12 +635,7 @@ def delete_item():
     confirm = messagebox.askyesno("Eliminar artículo", f"¿Estás seguro de eliminar el artículo con ID {item_id}?")
     
     if confirm:
-        response = requests.delete(f"{SERVER_URL}/items/{item_id}", headers={"X-API-KEY": API_KEY})
-        if response.status_code == 200:
-            messagebox.showinfo("Éxito", "Artículo eliminado correctamente.")
-            update_inventory_display()
-        else:
-            messagebox.showerror("Error", "No se pudo eliminar el artículo.")
+        queue_op("delete", {"id": item_id})
 
 def sell_item():
     selected_item = treeview.selection()
@@ -134,12 +650,7 @@ def sell_item():
         messagebox.showwarning("Advertencia", "La cantidad debe ser un número positivo.")
         return
 
-    response = requests.post(f"{SERVER_URL}/sell", json={"id": item_id, "quantity": qty}, headers={"X-API-KEY": API_KEY})
-    if response.status_code == 200:
-        messagebox.showinfo("Éxito", "Venta registrada correctamente.")
-        update_inventory_display()
-    else:
-        messagebox.showerror("Error", "No se pudo realizar la venta.")
+    queue_op("sell", {"id": item_id, "quantity": qty})
 
 def return_item():
     selected_item = treeview.selection()
@@ -154,12 +665,7 @@ def return_item():
         messagebox.showwarning("Advertencia", "La cantidad debe ser un número positivo.")
         return
 
-    response = requests.post(f"{SERVER_URL}/return", json={"id": item_id, "quantity": qty}, headers={"X-API-KEY": API_KEY})
-    if response.status_code == 200:
-        messagebox.showinfo("Éxito", "Devolución registrada correctamente.")
-        update_inventory_display()
-    else:
-        messagebox.showerror("Error", "No se pudo realizar la devolución.")
+    queue_op("return", {"id": item_id, "quantity": qty})
 
 # -------------------------
 # UI Principal (Tkinter)
@@ -184,6 +690,9 @@ scrollbar = ttk.Scrollbar(frame, orient="vertical", command=treeview.yview)
 scrollbar.pack(side="right", fill="y")
 treeview.config(yscrollcommand=scrollbar.set)
 
+window.bind("<FocusIn>", lambda e: window.after(50, update_paused))
+window.bind("<FocusOut>", lambda e: window.after(50, update_paused))
+
 button_frame = tk.Frame(window)
 button_frame.pack(pady=10)
 
@@ -201,7 +710,9 @@ if not API_KEY:
     messagebox.showerror("Error", "Se necesita la clave API para conectarse al servidor.")
     window.quit()
 
-update_inventory_display()
-window.after(10000, refresh_inventory)  # Llamar al refresco cada 10 segundos
+# La primera carga se hace ya dentro del mainloop, con la ventana pintada
+window.after(0, update_inventory_display, False)
+threading.Thread(target=listen_events, daemon=True).start()
+pump_events()
 
 window.mainloop()
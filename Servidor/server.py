@@ -9,21 +9,50 @@ Funciones incluidas:
 - SQLite local (server_data.db) creada automáticamente
 - Backups locales (diario al iniciar + manuales)
 - Restauración desde backups locales (GUI)
-- Sincronización instantánea: endpoint /last_update
+- Sincronización instantánea: endpoint /last_update y eventos push (/events, SSE)
 - Seguridad: API key (api_key.txt) creada/cambiada desde GUI
 - Logs guardados en archivo y muestra de últimos eventos en GUI
 - Control de clientes conectados (último ping)
 """
 
 import os
+import hmac
 import sys
+import json
 import sqlite3
 import threading
+import queue
+import pathlib
 import shutil
 import socket
+import time
+import zlib
+from collections import deque
+from itertools import islice
+from contextlib import contextmanager
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, send_file
 from flask_cors import CORS
+try:
+    import orjson  # opcional: serializador JSON en C, mucho más rápido que json
+except ImportError:
+    orjson = None
+try:
+    import msgpack  # opcional: /items en application/x-msgpack si el cliente lo pide
+except ImportError:
+    msgpack = None
+try:
+    import zstandard as zstd  # opcional: copias de seguridad comprimidas (.db.zst)
+except ImportError:
+    zstd = None
+try:
+    from flask_compress import Compress  # opcional: gzip/br/zstd en las respuestas JSON
+except ImportError:
+    Compress = None
+try:
+    from waitress import serve  # servidor WSGI de producción; sin él se usa el de desarrollo de Flask
+except ImportError:
+    serve = None
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
 
@@ -38,6 +67,19 @@ LOG_FILE = os.path.join(LOGS_DIR, "server_log.txt")
 HOST = "0.0.0.0"
 PORT = 5000
 GUI_MAX_LOG_LINES = 50
+READ_POOL_SIZE = 8  # conexiones de solo lectura para GET /items y la GUI
+MSGPACK_MIMETYPE = "application/x-msgpack"
+ITEM_COLUMNS = ("id", "nombre", "descripcion", "cantidad", "precio_usd", "precio_bs", "ultimo_update", "deleted")
+# columnas que devuelve /items por defecto (deleted siempre es 0 ahí)
+ACTIVE_ITEM_COLUMNS = ITEM_COLUMNS[:-1]
+EVENTS_BUFFER = 500  # eventos recientes disponibles para reanudar con Last-Event-ID
+EVENTS_KEEPALIVE = 15  # segundos entre comentarios keepalive en /events
+# hilos de waitress: cada cliente con /events abierto ocupa uno mientras dure la conexión
+SERVER_THREADS = 32
+# tope de conexiones /events simultáneas; el resto de hilos queda libre para peticiones normales
+MAX_EVENT_STREAMS = SERVER_THREADS - 8
+BACKUP_ZSTD_LEVEL = 3  # nivel de compresión de las copias .db.zst
+SQL_TRACE = False  # True: registra en el log cada sentencia SQL ejecutada (depuración)
 
 # -------------------------
 # Utilidades
@@ -46,9 +88,24 @@ def ensure_dirs():
     os.makedirs(BACKUPS_DIR, exist_ok=True)
     os.makedirs(LOGS_DIR, exist_ok=True)
 
-def now_ts():
+def now_ts_precise():
+    # hora exacta (sin caché) para quien no pueda aceptar hasta medio segundo de retraso
     return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
+# now_ts() se llama en cada escritura, log y ping: se sirve una cadena ya formateada
+# que un hilo de fondo renueva cada 0,5 s (igual que los servidores cachean "Date:")
+_CACHED_TS = [now_ts_precise()]
+
+def _ts_ticker():
+    while True:
+        time.sleep(0.5)
+        _CACHED_TS[0] = now_ts_precise()
+
+threading.Thread(target=_ts_ticker, daemon=True).start()
+
+def now_ts():
+    return _CACHED_TS[0]
+
 def get_local_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -60,32 +117,99 @@ def get_local_ip():
     except Exception:
         return "127.0.0.1"
 
+def dumps_json(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def json_response(obj, status=200):
+    return Response(dumps_json(obj), status=status, mimetype="application/json")
+
 # -------------------------
 # Logging (archivo + UI)
 # -------------------------
-LOG_LINES = []
+LOG_MAX_LINES = 2000
+LOG_LINES = deque(maxlen=LOG_MAX_LINES)  # historial acotado para la UI
 LOG_LOCK = threading.Lock()
 
+# un único hilo escribe el archivo: mantiene el descriptor abierto y hace flush
+# cuando la cola queda vacía, así log() nunca espera por disco
+_LOG_Q = queue.Queue()
+_LOG_TRUNCATE = object()  # marcador para vaciar el archivo desde el hilo escritor
+
+def _log_writer():
+    f = None
+    while True:
+        item = _LOG_Q.get()
+        try:
+            if f is None:
+                f = open(LOG_FILE, "a", encoding="utf-8")
+            if item is _LOG_TRUNCATE:
+                f.seek(0)
+                f.truncate()
+            else:
+                f.write(item + "\n")
+            if _LOG_Q.empty():
+                f.flush()
+        except Exception:
+            if f is not None:
+                try:
+                    f.close()
+                except Exception:
+                    pass
+            f = None
+        finally:
+            _LOG_Q.task_done()
+
+threading.Thread(target=_log_writer, daemon=True).start()
+
 def append_log_file(text):
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(text + "\n")
-    except Exception:
-        pass
+    _LOG_Q.put_nowait(text)
+
+def truncate_log_file():
+    _LOG_Q.put_nowait(_LOG_TRUNCATE)
+
+def flush_log_file():
+    """Espera a que el hilo escritor vuelque todo lo pendiente."""
+    _LOG_Q.join()
 
 def log(msg):
     ts = now_ts()
     line = f"[{ts}] {msg}"
     with LOG_LOCK:
         LOG_LINES.append(line)
-        # keep bounded history for UI
-        if len(LOG_LINES) > 2000:
-            LOG_LINES[:] = LOG_LINES[-2000:]
     append_log_file(line)
 
 # -------------------------
 # DB (concurrency-safe)
 # -------------------------
+# Sentencias fijas: sqlite3 reutiliza la sentencia preparada cuando el texto es idéntico
+SQL_UPSERT = """
+  INSERT INTO repuestos (id,nombre,descripcion,cantidad,precio_usd,precio_bs,ultimo_update,deleted)
+  VALUES (:id,:nombre,:descripcion,:cantidad,:precio_usd,:precio_bs,:ultimo_update,0)
+  ON CONFLICT(id) DO UPDATE SET
+    nombre=excluded.nombre,
+    descripcion=excluded.descripcion,
+    cantidad=excluded.cantidad,
+    precio_usd=excluded.precio_usd,
+    precio_bs=excluded.precio_bs,
+    ultimo_update=excluded.ultimo_update,
+    deleted=0
+"""
+SQL_SELECT_ACTIVE = f"SELECT {','.join(ACTIVE_ITEM_COLUMNS)} FROM repuestos WHERE deleted=0"
+SQL_SELECT_ONE = f"SELECT {','.join(ITEM_COLUMNS)} FROM repuestos WHERE id=? AND deleted=0"
+SQL_SELECT_CHANGED = f"SELECT {','.join(ITEM_COLUMNS)} FROM repuestos WHERE ultimo_update >= ?"
+SQL_HAS_META = "SELECT name FROM sqlite_master WHERE type='table' AND name='meta'"
+SQL_TABLE_NAMES = "SELECT name FROM sqlite_master WHERE type='table'"
+SQL_COUNT_ACTIVE = "SELECT COUNT(*) FROM repuestos WHERE deleted=0"
+SQL_SELECT_QTY = "SELECT cantidad FROM repuestos WHERE id=? AND deleted=0"
+SQL_SET_QTY = "UPDATE repuestos SET cantidad=?, ultimo_update=? WHERE id=?"
+SQL_MARK_DELETED = "UPDATE repuestos SET deleted=1, ultimo_update=? WHERE id=?"
+SQL_INSERT_VENTA = "INSERT INTO ventas (item_id,cantidad,fecha) VALUES (?,?,?)"
+SQL_INSERT_DEVOLUCION = "INSERT INTO devoluciones (item_id,cantidad,fecha) VALUES (?,?,?)"
+
+# Un único escritor serializado con DB_LOCK; las lecturas usan un pool de
+# conexiones de solo lectura y no toman el lock (WAL permite leer mientras se escribe).
 DB_LOCK = threading.Lock()
 
 class ServerDB:
@@ -94,23 +218,98 @@ class ServerDB:
         self._connect()
 
     def _connect(self):
-        first = not os.path.exists(self.filename)
         # timeout to wait for locks
-        self.conn = sqlite3.connect(self.filename, check_same_thread=False, timeout=10)
-        self.conn.row_factory = sqlite3.Row
-        if first:
+        self._write_conn = sqlite3.connect(self.filename, check_same_thread=False, timeout=10)
+        self._write_conn.row_factory = sqlite3.Row
+        self._tune(self._write_conn)
+        # el esquema se crea si falta la tabla meta, no según exista el archivo
+        # (un archivo vacío o una copia incompleta también cuentan como primera vez)
+        if not self._write_conn.execute(SQL_HAS_META).fetchone():
             self._init_schema()
+        self._ensure_indexes()
+        self._open_read_pool()
+
+    def _tune(self, conn, writer=True):
+        if SQL_TRACE:
+            conn.set_trace_callback(lambda sql: log(f"SQL: {sql}"))
+        if writer:
+            # WAL: los lectores no bloquean al escritor y cada commit no requiere fsync completo
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA wal_autocheckpoint=1000")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")  # ~64 MB de caché de páginas por conexión
+        conn.execute("PRAGMA mmap_size=134217728")
+
+    def _open_read_pool(self):
+        uri = pathlib.Path(self.export_db_path()).as_uri() + "?mode=ro"
+        pool = queue.Queue()
+        for _ in range(READ_POOL_SIZE):
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=10)
+            conn.row_factory = sqlite3.Row
+            self._tune(conn, writer=False)
+            pool.put(conn)
+        self._pool = pool
+
+    @contextmanager
+    def _reader(self):
+        # se devuelve al mismo pool del que salió
+        pool = self._pool
+        conn = pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
 
-    def close(self):
+    def online_backup(self, dest_path):
+        # API de backup de SQLite: copia por páginas con la DB abierta, sin bloquear peticiones
+        dst = sqlite3.connect(dest_path)
         try:
-            self.conn.close()
-        except Exception:
-            pass
+            with self._reader() as conn:
+                with dst:
+                    conn.backup(dst, pages=1000, sleep=0.001)
+        finally:
+            dst.close()
+
+    @staticmethod
+    def _open_source(source_path):
+        # immutable: una copia no cambia mientras se lee, y así SQLite no crea -wal/-shm junto a ella
+        uri = pathlib.Path(os.path.abspath(source_path)).as_uri() + "?mode=ro&immutable=1"
+        return sqlite3.connect(uri, uri=True)
+
+    @staticmethod
+    def check_source(source_path):
+        """Comprueba que source_path es una DB del inventario antes de sustituir la actual."""
+        try:
+            src = ServerDB._open_source(source_path)
+            try:
+                tables = {r[0] for r in src.execute(SQL_TABLE_NAMES)}
+            finally:
+                src.close()
+        except sqlite3.Error as e:
+            raise ValueError(f"La copia no es una base de datos válida: {e}")
+        if not {"meta", "repuestos"} <= tables:
+            raise ValueError("La copia no contiene las tablas del inventario")
+
+    def replace_file(self, source_path):
+        # solo con DB_LOCK tomado. Se copia la fuente sobre la conexión de escritura con la
+        # API de backup: el archivo, el WAL y el pool de lectores siguen abiertos, y una
+        # lectura en curso termina sobre su instantánea en lugar de ver el archivo cambiar.
+        self.check_source(source_path)
+        src = self._open_source(source_path)
+        try:
+            src.backup(self._write_conn)
+        finally:
+            src.close()
+        # copias antiguas pueden no tener los índices actuales
+        self._ensure_indexes()
 
     def _init_schema(self):
-        with DB_LOCK:
-            c = self.conn.cursor()
-            c.execute("""
+        # sin DB_LOCK: solo se llama desde _connect, al crear el objeto y antes de atender peticiones
+        conn = self._write_conn
+        with conn:
+            conn.execute("""
             CREATE TABLE IF NOT EXISTS repuestos (
                 id TEXT PRIMARY KEY,
                 nombre TEXT NOT NULL,
@@ -120,15 +319,15 @@ class ServerDB:
                 precio_bs REAL NOT NULL DEFAULT 0.0,
                 ultimo_update TEXT,
                 deleted INTEGER DEFAULT 0
-            )
+            ) WITHOUT ROWID
             """)
-            c.execute("""
+            conn.execute("""
             CREATE TABLE IF NOT EXISTS meta (
                 key TEXT PRIMARY KEY,
                 value TEXT
             )
             """)
-            c.execute("""
+            conn.execute("""
             CREATE TABLE IF NOT EXISTS ventas (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 item_id TEXT,
@@ -136,7 +335,7 @@ class ServerDB:
                 fecha TEXT
             )
             """)
-            c.execute("""
+            conn.execute("""
             CREATE TABLE IF NOT EXISTS devoluciones (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 item_id TEXT,
@@ -144,77 +343,132 @@ class ServerDB:
                 fecha TEXT
             )
             """)
-            self.conn.commit()
+
+    def _ensure_indexes(self):
+        # también en bases existentes; IF NOT EXISTS lo hace barato en cada conexión
+        conn = self._write_conn
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_repuestos_active ON repuestos(id) WHERE deleted=0")
+            # sin filtro parcial: la sincronización incremental también necesita los borrados
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_repuestos_updated ON repuestos(ultimo_update)")
+        conn.execute("PRAGMA optimize")
 
     def export_db_path(self):
         return os.path.abspath(self.filename)
 
-    def get_all(self):
-        with DB_LOCK:
-            c = self.conn.cursor()
-            c.execute("SELECT * FROM repuestos WHERE deleted=0")
-            return [dict(r) for r in c.fetchall()]
+    def get_all(self, fields=None):
+        """Items activos como (columnas, filas); las filas son tuplas, sin crear un dict por fila."""
+        # fields debe venir validado contra ITEM_COLUMNS
+        fields = fields or ACTIVE_ITEM_COLUMNS
+        sql = SQL_SELECT_ACTIVE if fields == ACTIVE_ITEM_COLUMNS else f"SELECT {','.join(fields)} FROM repuestos WHERE deleted=0"
+        with self._reader() as conn:
+            c = conn.cursor()
+            c.row_factory = None  # tuplas simples en lugar de sqlite3.Row
+            return list(fields), c.execute(sql).fetchall()
 
     def get_one(self, item_id):
-        with DB_LOCK:
-            c = self.conn.cursor()
-            c.execute("SELECT * FROM repuestos WHERE id=? AND deleted=0", (item_id,))
-            r = c.fetchone()
+        with self._reader() as conn:
+            r = conn.execute(SQL_SELECT_ONE, (item_id,)).fetchone()
             return dict(r) if r else None
 
+    def get_changed_since(self, ts):
+        """Filas modificadas desde ts (incluido, la resolución es de segundos): (activas, ids borrados)."""
+        with self._reader() as conn:
+            rows = conn.execute(SQL_SELECT_CHANGED, (ts,)).fetchall()
+        items = [dict(r) for r in rows if not r["deleted"]]
+        deletions = [r["id"] for r in rows if r["deleted"]]
+        return items, deletions
+
+    def count_active(self):
+        with self._reader() as conn:
+            return conn.execute(SQL_COUNT_ACTIVE).fetchone()[0]
+
     def upsert(self, item):
         item.setdefault("ultimo_update", now_ts())
-        with DB_LOCK:
-            c = self.conn.cursor()
-            c.execute("""
-              INSERT INTO repuestos (id,nombre,descripcion,cantidad,precio_usd,precio_bs,ultimo_update,deleted)
-              VALUES (:id,:nombre,:descripcion,:cantidad,:precio_usd,:precio_bs,:ultimo_update,0)
-              ON CONFLICT(id) DO UPDATE SET
-                nombre=excluded.nombre,
-                descripcion=excluded.descripcion,
-                cantidad=excluded.cantidad,
-                precio_usd=excluded.precio_usd,
-                precio_bs=excluded.precio_bs,
-                ultimo_update=excluded.ultimo_update,
-                deleted=0
-            """, item)
-            self.conn.commit()
+        conn = self._write_conn
+        # with conn: commit al salir, rollback si algo lanza una excepción
+        with DB_LOCK, conn:
+            conn.execute(SQL_UPSERT, item)
+
+    def upsert_many(self, items):
+        # un solo executemany y un solo commit (un fsync) para todo el lote
+        ts = now_ts()
+        for item in items:
+            item.setdefault("ultimo_update", ts)
+        conn = self._write_conn
+        with DB_LOCK, conn:
+            conn.executemany(SQL_UPSERT, items)
 
     def mark_deleted(self, item_id):
-        with DB_LOCK:
-            c = self.conn.cursor()
-            c.execute("UPDATE repuestos SET deleted=1, ultimo_update=? WHERE id=?", (now_ts(), item_id))
-            self.conn.commit()
+        conn = self._write_conn
+        with DB_LOCK, conn:
+            conn.execute(SQL_MARK_DELETED, (now_ts(), item_id))
 
     def sell(self, item_id, quantity):
-        with DB_LOCK:
-            c = self.conn.cursor()
-            c.execute("SELECT cantidad FROM repuestos WHERE id=? AND deleted=0", (item_id,))
-            r = c.fetchone()
+        conn = self._write_conn
+        # SELECT + UPDATE + INSERT en una sola transacción
+        with DB_LOCK, conn:
+            r = conn.execute(SQL_SELECT_QTY, (item_id,)).fetchone()
             if not r:
                 return False, "Artículo no encontrado"
             available = r["cantidad"]
             if quantity > available:
                 return False, "Stock insuficiente"
             newq = available - quantity
-            c.execute("UPDATE repuestos SET cantidad=?, ultimo_update=? WHERE id=?", (newq, now_ts(), item_id))
-            c.execute("INSERT INTO ventas (item_id,cantidad,fecha) VALUES (?,?,?)", (item_id, quantity, now_ts()))
-            self.conn.commit()
+            ts = now_ts()
+            conn.execute(SQL_SET_QTY, (newq, ts, item_id))
+            conn.execute(SQL_INSERT_VENTA, (item_id, quantity, ts))
             return True, newq
 
     def add_quantity(self, item_id, quantity):
-        with DB_LOCK:
-            c = self.conn.cursor()
-            c.execute("SELECT cantidad FROM repuestos WHERE id=? AND deleted=0", (item_id,))
-            r = c.fetchone()
+        conn = self._write_conn
+        with DB_LOCK, conn:
+            r = conn.execute(SQL_SELECT_QTY, (item_id,)).fetchone()
             if not r:
                 return False, "Artículo no encontrado"
             newq = r["cantidad"] + quantity
-            c.execute("UPDATE repuestos SET cantidad=?, ultimo_update=? WHERE id=?", (newq, now_ts(), item_id))
-            c.execute("INSERT INTO devoluciones (item_id,cantidad,fecha) VALUES (?,?,?)", (item_id, quantity, now_ts()))
-            self.conn.commit()
+            ts = now_ts()
+            conn.execute(SQL_SET_QTY, (newq, ts, item_id))
+            conn.execute(SQL_INSERT_DEVOLUCION, (item_id, quantity, ts))
             return True, newq
 
+    def sell_many(self, entries):
+        return self._adjust_many(entries, -1, SQL_INSERT_VENTA)
+
+    def add_quantity_many(self, entries):
+        return self._adjust_many(entries, 1, SQL_INSERT_DEVOLUCION)
+
+    def _adjust_many(self, entries, sign, audit_sql):
+        """entries: [(item_id, quantity)]. Devuelve [(ok, nueva_cantidad o error)] en el mismo orden.
+
+        Todo el lote va en una transacción: executemany para los UPDATE y para el registro.
+        """
+        ts = now_ts()
+        results = []
+        current = {}
+        audit = []
+        conn = self._write_conn
+        with DB_LOCK, conn:
+            for item_id, quantity in entries:
+                if item_id not in current:
+                    r = conn.execute(SQL_SELECT_QTY, (item_id,)).fetchone()
+                    current[item_id] = r["cantidad"] if r else None
+                available = current[item_id]
+                if available is None:
+                    results.append((False, "Artículo no encontrado"))
+                    continue
+                newq = available + sign * quantity
+                if newq < 0:
+                    results.append((False, "Stock insuficiente"))
+                    continue
+                current[item_id] = newq
+                audit.append((item_id, quantity, ts))
+                results.append((True, newq))
+            changed = {item_id for item_id, _, _ in audit}
+            conn.executemany(SQL_SET_QTY, [(current[item_id], ts, item_id) for item_id in changed])
+            conn.executemany(audit_sql, audit)
+        return results
+
 # -------------------------
 # Estado global
 # -------------------------
@@ -222,50 +476,118 @@ ensure_dirs()
 db = ServerDB()
 app = Flask(__name__)
 CORS(app)
+if Compress is not None:
+    # solo cuerpos de datos; /events (text/event-stream) y las descargas de copias no se tocan
+    app.config["COMPRESS_MIMETYPES"] = ["application/json", MSGPACK_MIMETYPE]
+    app.config["COMPRESS_LEVEL"] = 4
+    app.config["COMPRESS_MIN_SIZE"] = 500
+    Compress(app)
 
 # last_update para sincronización
 LAST_UPDATE_LOCK = threading.Lock()
 LAST_UPDATE = now_ts()
+# last_update tiene resolución de segundos; DATA_VERSION cambia en cada modificación
+# y, junto con BOOT_ID, identifica la versión de los datos en los ETag de /items.
+DATA_VERSION = 0
+BOOT_ID = os.urandom(4).hex()
 
 CLIENTS_LAST_SEEN = {}
 CLIENTS_LOCK = threading.Lock()
 
 def update_last_update():
-    global LAST_UPDATE
+    global LAST_UPDATE, DATA_VERSION
     with LAST_UPDATE_LOCK:
         LAST_UPDATE = now_ts()
-    log(f"GLOBAL last_update actualizado a {LAST_UPDATE}")
+        DATA_VERSION += 1
+        ts = LAST_UPDATE
+    # despierta a los clientes de /events (sustituye a sondear /last_update)
+    publish_event("last_update", {"last_update": ts})
+    log(f"GLOBAL last_update actualizado a {ts}")
 
 def get_last_update():
     with LAST_UPDATE_LOCK:
         return LAST_UPDATE
 
+def get_data_version():
+    with LAST_UPDATE_LOCK:
+        return DATA_VERSION
+
+# /ping solo encola (client_id, time.monotonic()); un hilo de fondo lo vuelca en
+# CLIENTS_LAST_SEEN tomando el lock una vez por tanda
+_SEEN_Q = queue.SimpleQueue()
+
+def _seen_folder():
+    while True:
+        batch = [_SEEN_Q.get()]
+        while True:
+            try:
+                batch.append(_SEEN_Q.get_nowait())
+            except queue.Empty:
+                break
+        with CLIENTS_LOCK:
+            CLIENTS_LAST_SEEN.update(batch)
+
+threading.Thread(target=_seen_folder, daemon=True).start()
+
 def update_client_seen(client_id):
     if not client_id:
         return
-    with CLIENTS_LOCK:
-        CLIENTS_LAST_SEEN[client_id] = datetime.utcnow()
+    _SEEN_Q.put_nowait((client_id, time.monotonic()))
+
+# -------------------------
+# Eventos push (SSE)
+# -------------------------
+EVENT_COND = threading.Condition()
+EVENTS = deque(maxlen=EVENTS_BUFFER)
+EVENT_SEQ = 0
+EVENT_STREAMS = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+def publish_event(kind, data):
+    global EVENT_SEQ
+    with EVENT_COND:
+        EVENT_SEQ += 1
+        EVENTS.append((EVENT_SEQ, kind, data))
+        EVENT_COND.notify_all()
+
+def get_event_seq():
+    with EVENT_COND:
+        return EVENT_SEQ
+
+def publish_item(kind, item_id):
+    """Publica la fila tal como quedó guardada (id TEXT, tipos de la DB), no el payload recibido."""
+    row = db.get_one(item_id)
+    if row is not None:  # borrada entretanto: ya llegará su item_deleted
+        publish_event(kind, row)
+
+def format_event(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {dumps_json(data).decode('utf-8')}\n\n"
 
 def get_clients_snapshot():
-    now = datetime.utcnow()
-    out = []
+    now = time.monotonic()
     with CLIENTS_LOCK:
-        for cid, dt in CLIENTS_LAST_SEEN.items():
-            diff = now - dt
-            out.append({"client_id": cid, "last_seen": dt.isoformat(), "seconds_ago": int(diff.total_seconds())})
-    return out
+        return [{"client_id": cid, "seconds_ago": int(now - seen)} for cid, seen in CLIENTS_LAST_SEEN.items()]
 
 # -------------------------
 # API Key helper
 # -------------------------
+# la clave se relee del disco solo si cambia el archivo (mtime/tamaño)
+_API_KEY_CACHE = {"stamp": None, "key": None}
+
 def read_api_key():
-    if not os.path.exists(API_KEY_FILE):
-        return None
     try:
-        with open(API_KEY_FILE, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    except Exception:
+        st = os.stat(API_KEY_FILE)
+    except OSError:
         return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    if stamp != _API_KEY_CACHE["stamp"]:
+        try:
+            with open(API_KEY_FILE, "r", encoding="utf-8") as f:
+                key = f.read().strip()
+        except Exception:
+            return None
+        _API_KEY_CACHE["key"] = key
+        _API_KEY_CACHE["stamp"] = stamp
+    return _API_KEY_CACHE["key"]
 
 def write_api_key(newkey):
     try:
@@ -273,20 +595,148 @@ def write_api_key(newkey):
             f.write(newkey.strip())
     except Exception as e:
         log(f"Error escribiendo API key: {e}")
+    _API_KEY_CACHE["stamp"] = None
+
+def api_key_matches(given, expected):
+    """Comparación en tiempo constante (no revela cuántos caracteres coinciden)."""
+    return hmac.compare_digest(given.encode("utf-8"), expected.encode("utf-8"))
 
 def require_api_key(f):
     def wrapper(*args, **kwargs):
         server_key = read_api_key()
         if server_key is None:
-            return jsonify({"error": "server_api_key_no_configurada"}), 403
+            return json_response({"error": "server_api_key_no_configurada"}, 403)
         header = request.headers.get("X-API-KEY", "")
-        if not header or header != server_key:
+        if not header or not api_key_matches(header, server_key):
             log(f"Intento no autorizado desde {request.remote_addr} a {request.path}")
-            return jsonify({"error": "api_key_invalida_o_faltante"}), 401
+            return json_response({"error": "api_key_invalida_o_faltante"}, 401)
         return f(*args, **kwargs)
     wrapper.__name__ = f.__name__
     return wrapper
 
+# Cuerpos serializados de GET /items por (fields, formato, filas): (versión, etag, bytes, event_seq)
+ITEMS_CACHE = {}
+ITEMS_CACHE_LOCK = threading.Lock()
+
+def items_payload(columns, rows, as_rows):
+    """{"columns", "rows"} para clientes que lo piden (?format=rows); si no, {"items": [objetos]}
+    como siempre, para no romper clientes ya instalados."""
+    if as_rows:
+        return {"columns": columns, "rows": rows}
+    return {"items": [dict(zip(columns, row)) for row in rows]}
+
+def wants_rows():
+    return request.args.get("format") == "rows"
+
+def items_body(fields, fmt, as_rows):
+    """Cuerpo de GET /items, su ETag y el event_seq que refleja; se reutiliza hasta el siguiente cambio de datos."""
+    key = (fields, fmt, as_rows)
+    version = get_data_version()
+    with ITEMS_CACHE_LOCK:
+        cached = ITEMS_CACHE.get(key)
+    if cached and cached[0] == version:
+        return cached[1:]
+    # se lee antes que las filas: todo evento <= seq ya está incluido en la foto
+    seq = get_event_seq()
+    columns, rows = db.get_all(fields)
+    body = items_payload(columns, rows, as_rows)
+    body["server_time"] = now_ts()
+    body["last_update"] = get_last_update()
+    if fmt == "msgpack":
+        data = msgpack.packb(body, use_bin_type=True)
+    else:
+        data = dumps_json(body)
+    etag = f"{BOOT_ID}-{version}-{zlib.crc32(repr(key).encode()):08x}"
+    with ITEMS_CACHE_LOCK:
+        # las entradas de versiones anteriores ya no pueden servirse: se liberan
+        for old_key in [k for k, v in ITEMS_CACHE.items() if v[0] != version]:
+            del ITEMS_CACHE[old_key]
+        ITEMS_CACHE[key] = (version, etag, data, seq)
+    return etag, data, seq
+
+def etag_matches(etag):
+    """If-None-Match contra etag, aceptando también "<etag>:<algoritmo>" (el ETag que reenvía
+    el cliente cuando Flask-Compress comprimió la respuesta anterior)."""
+    inm = request.if_none_match
+    if not inm:
+        return False
+    return inm.star_tag or any(tag.split(":", 1)[0] == etag for tag in inm.as_set(include_weak=True))
+
+def wants_msgpack():
+    if msgpack is None:
+        return False
+    return request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+# -------------------------
+# Copias de seguridad
+# -------------------------
+# temporales de las copias (incluido el -journal que SQLite crea mientras escribe una)
+BACKUP_TEMP_SUFFIXES = (".tmp", ".tmp-journal", "-journal", "-wal", "-shm")
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def snapshot_backup(prefix="backup"):
+    """Copia en línea sin comprimir: (ruta escrita, ruta final .db). Es la única parte que
+    necesita ver la DB; compress_backup() puede ejecutarse después sin ningún lock."""
+    os.makedirs(BACKUPS_DIR, exist_ok=True)
+    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    dest = os.path.join(BACKUPS_DIR, f"{prefix}_{timestamp}.db")
+    # con zstd la copia sin comprimir es un temporal .tmp (list_backups la oculta)
+    raw = dest if zstd is None else dest + ".tmp"
+    try:
+        db.online_backup(raw)
+    except Exception:
+        if raw != dest:
+            _remove_quietly(raw)
+        raise
+    return raw, dest
+
+def compress_backup(raw, dest):
+    """Comprime con zstd la copia de snapshot_backup() y devuelve la ruta definitiva."""
+    if raw == dest:
+        return dest
+    zst_tmp = dest + ".zst.tmp"
+    try:
+        with open(raw, "rb") as fin, open(zst_tmp, "wb") as fout:
+            zstd.ZstdCompressor(level=BACKUP_ZSTD_LEVEL).copy_stream(fin, fout)
+        os.replace(zst_tmp, dest + ".zst")
+    finally:
+        _remove_quietly(raw)
+        _remove_quietly(zst_tmp)
+    return dest + ".zst"
+
+def create_backup(prefix="backup"):
+    """Copia en línea de la DB en BACKUPS_DIR, comprimida con zstd si está disponible. Devuelve la ruta."""
+    return compress_backup(*snapshot_backup(prefix))
+
+def is_backup_file(fname):
+    return not fname.endswith(BACKUP_TEMP_SUFFIXES)
+
+def list_backup_files():
+    if not os.path.exists(BACKUPS_DIR):
+        return []
+    return sorted((f for f in os.listdir(BACKUPS_DIR) if is_backup_file(f)), reverse=True)
+
+@contextmanager
+def backup_as_db(path):
+    """Ruta a una copia .db lista para usar; las .db.zst se descomprimen a un temporal."""
+    if not path.endswith(".zst"):
+        yield path
+        return
+    if zstd is None:
+        raise RuntimeError("La copia está comprimida con zstd y el módulo zstandard no está instalado")
+    tmp = path[:-len(".zst")] + ".restore.tmp"
+    try:
+        with open(path, "rb") as fin, open(tmp, "wb") as fout:
+            zstd.ZstdDecompressor().copy_stream(fin, fout)
+        yield tmp
+    finally:
+        _remove_quietly(tmp)
+
 # -------------------------
 # Endpoints Flask
 # -------------------------
@@ -294,30 +744,170 @@ def require_api_key(f):
 def ping():
     client_id = request.headers.get("X-CLIENT-ID", None)
     update_client_seen(client_id)
-    return jsonify({"ok": True, "server_time": now_ts(), "last_update": get_last_update()})
+    return json_response({"ok": True, "server_time": now_ts(), "last_update": get_last_update()})
 
 @app.route("/last_update", methods=["GET"])
 def last_update():
-    return jsonify({"last_update": get_last_update()})
+    return json_response({"last_update": get_last_update()})
+
+@app.route("/events", methods=["GET"])
+@require_api_key
+def events():
+    try:
+        last_id = int(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        last_id = None
+
+    def stream():
+        cursor = last_id
+        with EVENT_COND:
+            current = EVENT_SEQ
+            oldest = EVENTS[0][0] if EVENTS else current + 1
+        if cursor is None:
+            # conexión nueva: el cliente hace una carga completa y sigue desde aquí
+            cursor = current
+            yield format_event(current, "ready", {"last_update": get_last_update()})
+        elif cursor > current or cursor < oldest - 1:
+            # servidor reiniciado o eventos perdidos: no se puede reanudar
+            cursor = current
+            yield format_event(current, "resync", {"last_update": get_last_update()})
+        while True:
+            with EVENT_COND:
+                if EVENT_SEQ <= cursor:
+                    EVENT_COND.wait(timeout=EVENTS_KEEPALIVE)
+                pending = [e for e in EVENTS if e[0] > cursor]
+                current = EVENT_SEQ
+            if pending and pending[0][0] > cursor + 1:
+                # el cliente quedó más de EVENTS_BUFFER eventos atrás: los que faltan ya no
+                # están en el buffer, así que se le pide una recarga completa
+                cursor = current
+                yield format_event(current, "resync", {"last_update": get_last_update()})
+                continue
+            if not pending:
+                yield ": keepalive\n\n"
+                continue
+            for event_id, kind, data in pending:
+                cursor = event_id
+                yield format_event(event_id, kind, data)
+
+    # sin hueco: 503 y el cliente sigue por sondeo hasta que pueda reconectar. Sin Retry-After:
+    # el Retry de la sesión del cliente lo respetaría y bloquearía el intento ~1 minuto; el
+    # propio listen_events ya espera con backoff antes de reconectar.
+    if not EVENT_STREAMS.acquire(blocking=False):
+        return json_response({"error": "demasiadas conexiones de eventos"}, 503)
+    resp = Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # el servidor WSGI cierra la respuesta al terminar o al cortarse la conexión
+    resp.call_on_close(EVENT_STREAMS.release)
+    return resp
 
 @app.route("/items", methods=["GET", "POST"])
 @require_api_key
 def items():
     if request.method == "GET":
-        items = db.get_all()
-        return jsonify({"items": items, "server_time": now_ts(), "last_update": get_last_update()})
+        # ?fields=id,nombre,... limita las columnas devueltas
+        since = request.args.get("since")
+        if since:
+            # sincronización incremental: solo lo cambiado (y lo borrado) desde since
+            changed, deletions = db.get_changed_since(since)
+            return json_response({"items": changed, "deletions": deletions, "last_update": get_last_update()})
+        # proyección normalizada (orden de ITEM_COLUMNS, sin repetidos): acota las claves de ITEMS_CACHE
+        requested = set(request.args.get("fields", "").split(","))
+        fields = tuple(c for c in ITEM_COLUMNS if c in requested)
+        fmt = "msgpack" if wants_msgpack() else "json"
+        etag, data, seq = items_body(fields, fmt, wants_rows())
+        if etag_matches(etag):
+            # sin cambios: 304 sin cuerpo, antes de serializar o comprimir nada
+            resp = Response(status=304)
+        else:
+            resp = Response(data, mimetype=MSGPACK_MIMETYPE if fmt == "msgpack" else "application/json")
+        resp.headers["Vary"] = "Accept"
+        # el cliente descarta fotos más antiguas que los eventos SSE que ya aplicó
+        resp.headers["X-Event-Seq"] = str(seq)
+        resp.set_etag(etag)
+        return resp
     else:
         data = request.get_json()
         if not data:
-            return jsonify({"error": "No JSON recibido"}), 400
+            return json_response({"error": "No JSON recibido"}, 400)
         item = data
         if "id" not in item:
-            return jsonify({"error": "id es requerido"}), 400
+            return json_response({"error": "id es requerido"}, 400)
         item.setdefault("ultimo_update", now_ts())
         db.upsert(item)
+        # primero el evento y después la versión: una foto de /items válida tras el cambio
+        # ya tiene un event_seq que cubre este evento
+        publish_item("item_created", item["id"])
         update_last_update()
         log(f"Upsert item {item.get('id')} nombre='{item.get('nombre')}'")
-        return jsonify({"ok": True, "item": item})
+        return json_response({"ok": True, "item": item})
+
+def apply_batch_op(kind, data):
+    """Aplica una operación de /items/batch y devuelve su resultado."""
+    if not isinstance(data, dict):
+        return {"ok": False, "error": "payload debe ser un objeto"}
+    item_id = data.get("id")
+    if not item_id:
+        return {"ok": False, "error": "id es requerido"}
+    try:
+        if kind in ("add", "update"):
+            data.setdefault("ultimo_update", now_ts())
+            db.upsert(data)
+            publish_item("item_created" if kind == "add" else "item_updated", item_id)
+            log(f"Batch {kind} item {item_id}")
+            return {"ok": True}
+        if kind == "delete":
+            db.mark_deleted(item_id)
+            publish_event("item_deleted", {"id": str(item_id)})
+            log(f"Batch delete item {item_id}")
+            return {"ok": True}
+        if kind in ("sell", "return"):
+            qty = int(data.get("quantity", 1))
+            ok, res = db.sell(item_id, qty) if kind == "sell" else db.add_quantity(item_id, qty)
+            if not ok:
+                log(f"Batch {kind} fallido {item_id} qty={qty} - {res}")
+                return {"ok": False, "error": res}
+            publish_event("stock_changed", {"id": str(item_id), "cantidad": res})
+            log(f"Batch {kind} {item_id} qty={qty}")
+            return {"ok": True, "new_quantity": res}
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        log(f"Batch {kind} error {item_id}: {e}")
+        return {"ok": False, "error": str(e)}
+    return {"ok": False, "error": f"operación desconocida: {kind}"}
+
+@app.route("/items/batch", methods=["POST"])
+@require_api_key
+def items_batch():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = None
+    if payload and isinstance(payload.get("items"), list):
+        # alta/edición masiva: una sola transacción
+        items = payload["items"]
+        if not all(isinstance(it, dict) and it.get("id") for it in items):
+            return json_response({"error": "id es requerido en cada item"}, 400)
+        try:
+            db.upsert_many(items)
+        except sqlite3.Error as e:
+            log(f"Batch upsert error: {e}")
+            return json_response({"ok": False, "error": str(e)}, 400)
+        for it in items:
+            publish_item("item_updated", it["id"])
+        update_last_update()
+        log(f"Batch upsert de {len(items)} items")
+        return json_response({"ok": True, "count": len(items), "last_update": get_last_update()})
+    if not payload or not isinstance(payload.get("ops"), list):
+        return json_response({"error": "se esperaba {'ops': [...]} o {'items': [...]}"}, 400)
+    results = [apply_batch_op(op.get("op"), op.get("payload") or {}) if isinstance(op, dict)
+               else {"ok": False, "error": "cada operación debe ser un objeto"}
+               for op in payload["ops"]]
+    if any(r["ok"] for r in results):
+        update_last_update()
+    seq = get_event_seq()
+    columns, rows = db.get_all()
+    body = {"ok": True, "results": results, **items_payload(columns, rows, wants_rows()), "last_update": get_last_update()}
+    resp = json_response(body)
+    resp.headers["X-Event-Seq"] = str(seq)
+    return resp
 
 @app.route("/items/<item_id>", methods=["GET", "PUT", "DELETE"])
 @require_api_key
@@ -325,92 +915,119 @@ def item_by_id(item_id):
     if request.method == "GET":
         it = db.get_one(item_id)
         if not it:
-            return jsonify({"error": "no encontrado"}), 404
-        return jsonify(it)
+            return json_response({"error": "no encontrado"}, 404)
+        return json_response(it)
     elif request.method == "PUT":
         data = request.get_json()
         if not data:
-            return jsonify({"error":"no json"}), 400
+            return json_response({"error":"no json"}, 400)
         data["id"] = item_id
         data.setdefault("ultimo_update", now_ts())
         db.upsert(data)
+        publish_item("item_updated", item_id)
         update_last_update()
         log(f"PUT /items/{item_id}")
-        return jsonify({"ok": True, "item": data})
+        return json_response({"ok": True, "item": data})
     else:
         db.mark_deleted(item_id)
+        publish_event("item_deleted", {"id": item_id})
         update_last_update()
         log(f"DELETE /items/{item_id}")
-        return jsonify({"ok": True})
+        return json_response({"ok": True})
 
 @app.route("/sell", methods=["POST"])
 @require_api_key
 def sell():
     payload = request.get_json()
     if not payload:
-        return jsonify({"error": "no json"}), 400
+        return json_response({"error": "no json"}, 400)
     item_id = payload.get("id")
     qty = int(payload.get("quantity", 1))
     ok, res = db.sell(item_id, qty)
     if not ok:
         log(f"Venta fallida {item_id} qty={qty} - {res}")
-        return jsonify({"ok": False, "error": res}), 400
+        return json_response({"ok": False, "error": res}, 400)
     it = db.get_one(item_id)
+    publish_event("stock_changed", {"id": str(item_id), "cantidad": res})
     update_last_update()
     log(f"Venta {item_id} qty={qty}")
-    return jsonify({"ok": True, "new_quantity": res, "item": it})
+    return json_response({"ok": True, "new_quantity": res, "item": it})
 
 @app.route("/return", methods=["POST"])
 @require_api_key
 def ret():
     payload = request.get_json()
     if not payload:
-        return jsonify({"error": "no json"}), 400
+        return json_response({"error": "no json"}, 400)
     item_id = payload.get("id")
     qty = int(payload.get("quantity", 1))
     ok, res = db.add_quantity(item_id, qty)
     if not ok:
         log(f"Devolución fallida {item_id} qty={qty} - {res}")
-        return jsonify({"ok": False, "error": res}), 400
+        return json_response({"ok": False, "error": res}, 400)
     it = db.get_one(item_id)
+    publish_event("stock_changed", {"id": str(item_id), "cantidad": res})
     update_last_update()
     log(f"Devolución {item_id} qty={qty}")
-    return jsonify({"ok": True, "new_quantity": res, "item": it})
+    return json_response({"ok": True, "new_quantity": res, "item": it})
+
+def stock_batch(kind):
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("items"), list):
+        return json_response({"error": "se esperaba {'items': [...]}"}, 400)
+    try:
+        entries = [(e["id"], int(e.get("quantity", 1))) for e in payload["items"]]
+        # el id se usa como clave de diccionario en _adjust_many: listas u objetos darían un 500
+        if not all(isinstance(item_id, (str, int)) for item_id, _ in entries):
+            raise TypeError("id no escalar")
+    except (KeyError, TypeError, ValueError):
+        return json_response({"error": "cada item necesita id y quantity"}, 400)
+    res = db.sell_many(entries) if kind == "sell" else db.add_quantity_many(entries)
+    results = []
+    for (item_id, qty), (ok, value) in zip(entries, res):
+        if ok:
+            publish_event("stock_changed", {"id": str(item_id), "cantidad": value})
+            results.append({"id": item_id, "ok": True, "new_quantity": value})
+        else:
+            results.append({"id": item_id, "ok": False, "error": value})
+    if any(r["ok"] for r in results):
+        update_last_update()
+    log(f"Batch {kind}: {sum(r['ok'] for r in results)}/{len(results)} aplicados")
+    return json_response({"ok": True, "results": results})
+
+@app.route("/sell/batch", methods=["POST"])
+@require_api_key
+def sell_batch():
+    return stock_batch("sell")
+
+@app.route("/return/batch", methods=["POST"])
+@require_api_key
+def return_batch():
+    return stock_batch("return")
 
 @app.route("/backup", methods=["POST"])
 @require_api_key
 def backup():
     try:
-        if not os.path.exists(BACKUPS_DIR):
-            os.makedirs(BACKUPS_DIR, exist_ok=True)
-        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        dest = os.path.join(BACKUPS_DIR, f"backup_{timestamp}.db")
-        src = db.export_db_path()
-        with DB_LOCK:
-            db.conn.commit()
-            db.conn.close()
-            shutil.copyfile(src, dest)
-            db._connect()
+        dest = create_backup()
         log(f"Backup creado: {dest}")
-        return jsonify({"ok": True, "local_copy": dest})
+        return json_response({"ok": True, "local_copy": dest})
     except Exception as e:
         log(f"Error backup: {e}")
-        return jsonify({"ok": False, "error": str(e)}), 500
+        return json_response({"ok": False, "error": str(e)}, 500)
 
 @app.route("/list_backups", methods=["GET"])
 @require_api_key
 def list_backups():
-    files = []
-    if os.path.exists(BACKUPS_DIR):
-        files = sorted(os.listdir(BACKUPS_DIR), reverse=True)
-    return jsonify({"backups": files})
+    return json_response({"backups": list_backup_files()})
 
 @app.route("/download_backup/<fname>", methods=["GET"])
 @require_api_key
 def download_backup(fname):
+    # las .db.zst se envían tal cual (comprimidas); los temporales no se exponen
     p = os.path.join(BACKUPS_DIR, fname)
-    if not os.path.exists(p):
-        return jsonify({"error":"no encontrado"}), 404
+    if not is_backup_file(fname) or not os.path.exists(p):
+        return json_response({"error":"no encontrado"}, 404)
     return send_file(p, as_attachment=True)
 
 # -------------------------
@@ -421,7 +1038,11 @@ def run_flask_app():
     log("Iniciando hilo del servidor Flask")
     logging.getLogger('werkzeug').setLevel(logging.ERROR)
     try:
-        app.run(host=HOST, port=PORT, threaded=True, use_reloader=False)
+        if serve is not None:
+            serve(app, host=HOST, port=PORT, threads=SERVER_THREADS, connection_limit=1000, channel_timeout=60)
+        else:
+            log("waitress no instalado: usando el servidor de desarrollo de Flask")
+            app.run(host=HOST, port=PORT, threaded=True, use_reloader=False)
     except Exception as e:
         log(f"Flask error al iniciar: {e}")
 
@@ -440,6 +1061,10 @@ class ServerGUI:
         root.geometry("1024x700")
         root.minsize(900,600)
 
+        # contador de items activos, recalculado solo cuando cambian los datos
+        self._count_version = None
+        self._active_count = "?"
+
         self._build_header()
         self._build_main()
         self._refresh_gui_loop()
@@ -502,22 +1127,22 @@ class ServerGUI:
     def _refresh_gui_loop(self):
         # update logs (last N)
         with LOG_LOCK:
-            text = "\n".join(LOG_LINES[-GUI_MAX_LOG_LINES:])
+            start = max(0, len(LOG_LINES) - GUI_MAX_LOG_LINES)
+            text = "\n".join(islice(LOG_LINES, start, None))
         self.log_text.config(state="normal")
         self.log_text.delete("1.0", tk.END)
         self.log_text.insert(tk.END, text)
         self.log_text.config(state="disabled")
 
         # update status
-        try:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM repuestos WHERE deleted=0")
-            total = c.fetchone()[0]
-            conn.close()
-        except Exception:
-            total = "?"
-        status = f"Items activos: {total}\nÚltima actualización: {get_last_update()}\nHora local: {now_ts()}"
+        version = get_data_version()
+        if version != self._count_version:
+            try:
+                self._active_count = db.count_active()
+                self._count_version = version
+            except Exception:
+                self._active_count = "?"
+        status = f"Items activos: {self._active_count}\nÚltima actualización: {get_last_update()}\nHora local: {now_ts()}"
         self.status_text.config(text=status)
 
         # update clients
@@ -549,7 +1174,7 @@ class ServerGUI:
         old = simpledialog.askstring("Clave actual", "Introduce la clave actual:", show="*")
         if old is None:
             return
-        if old != existing:
+        if not api_key_matches(old, existing):
             messagebox.showerror("Incorrecto", "La clave actual no coincide.")
             return
         new = simpledialog.askstring("Nueva clave", "Introduce la nueva clave:", show="*")
@@ -560,13 +1185,9 @@ class ServerGUI:
         messagebox.showinfo("Hecho", "API key actualizada correctamente.")
 
     def clear_logs(self):
-        global LOG_LINES
         with LOG_LOCK:
-            LOG_LINES = []
-        try:
-            open(LOG_FILE, "w", encoding="utf-8").close()
-        except Exception:
-            pass
+            LOG_LINES.clear()
+        truncate_log_file()
         self.log_text.config(state="normal")
         self.log_text.delete("1.0", tk.END)
         self.log_text.config(state="disabled")
@@ -577,6 +1198,7 @@ class ServerGUI:
         if not dest:
             return
         try:
+            flush_log_file()
             shutil.copyfile(LOG_FILE, dest)
             messagebox.showinfo("Exportado", f"Logs exportados a {dest}")
             log(f"Logs exportados a {dest}")
@@ -586,16 +1208,7 @@ class ServerGUI:
 
     def force_backup(self):
         try:
-            if not os.path.exists(BACKUPS_DIR):
-                os.makedirs(BACKUPS_DIR, exist_ok=True)
-            timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-            dest = os.path.join(BACKUPS_DIR, f"backup_{timestamp}.db")
-            src = db.export_db_path()
-            with DB_LOCK:
-                db.conn.commit()
-                db.conn.close()
-                shutil.copyfile(src, dest)
-                db._connect()
+            dest = create_backup()
             log(f"Backup manual creado: {dest}")
             messagebox.showinfo("Backup", f"Copia creada: {dest}")
         except Exception as e:
@@ -603,10 +1216,7 @@ class ServerGUI:
             messagebox.showerror("Error", str(e))
 
     def restore_backup_dialog(self):
-        if not os.path.exists(BACKUPS_DIR):
-            messagebox.showinfo("Restaurar", "No hay copias de seguridad.")
-            return
-        files = sorted(os.listdir(BACKUPS_DIR), reverse=True)
+        files = list_backup_files()
         if not files:
             messagebox.showinfo("Restaurar", "No hay copias de seguridad.")
             return
@@ -621,18 +1231,17 @@ class ServerGUI:
         if not messagebox.askyesno("Confirmar restauración", f"Se creará una copia previa y se restaurará {sel}. ¿Continuar?"):
             return
         try:
-            # create pre-restore copy
-            src = db.export_db_path()
-            pre = os.path.join(BACKUPS_DIR, f"pre_restore_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.db")
-            with DB_LOCK:
-                db.conn.commit()
-                db.conn.close()
-                shutil.copyfile(src, pre)
-                # replace
-                shutil.copyfile(p, src)
-                # reconnect DB
-                db._connect()
+            # descompresión y validación antes de tomar DB_LOCK
+            with backup_as_db(p) as source:
+                db.check_source(source)
+                with DB_LOCK:
+                    # pre-restore: solo la copia en línea; se comprime ya sin el lock
+                    pre_raw, pre_dest = snapshot_backup("pre_restore")
+                    # replace DB contents in place
+                    db.replace_file(source)
+            pre = compress_backup(pre_raw, pre_dest)
             update_last_update()
+            publish_event("resync", {"last_update": get_last_update()})
             log(f"Restauración ejecutada desde {sel}. Pre-restore guardado en {pre}")
             messagebox.showinfo("Restaurado", "Restauración completada. DB reemplazada.")
         except Exception as e:
@@ -640,14 +1249,11 @@ class ServerGUI:
             messagebox.showerror("Error", str(e))
 
     def export_db_file(self):
-        src = db.export_db_path()
         dest = filedialog.asksaveasfilename(title="Exportar DB como...", defaultextension=".db", filetypes=[("SQLite DB","*.db"),("All","*.*")])
         if not dest:
             return
         try:
-            with DB_LOCK:
-                db.conn.commit()
-                shutil.copyfile(src, dest)
+            db.online_backup(dest)
             messagebox.showinfo("Exportado", f"DB exportada a {dest}")
             log(f"DB exportada a {dest}")
         except Exception as e:
@@ -657,6 +1263,7 @@ class ServerGUI:
     def on_exit(self):
         if messagebox.askyesno("Salir", "¿Deseas detener el servidor y salir?"):
             log("Servidor detenido desde GUI")
+            flush_log_file()
             try:
                 os._exit(0)
             except Exception:
@@ -668,16 +1275,7 @@ class ServerGUI:
 def auto_backup_on_start():
     # create backup on start (daily)
     try:
-        if not os.path.exists(BACKUPS_DIR):
-            os.makedirs(BACKUPS_DIR, exist_ok=True)
-        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        dest = os.path.join(BACKUPS_DIR, f"backup_{timestamp}.db")
-        src = db.export_db_path()
-        with DB_LOCK:
-            db.conn.commit()
-            db.conn.close()
-            shutil.copyfile(src, dest)
-            db._connect()
+        dest = create_backup()
         log(f"Backup diario creado: {dest}")
     except Exception as e:
         log(f"Error backup diario: {e}")